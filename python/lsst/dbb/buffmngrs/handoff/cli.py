@@ -23,14 +23,13 @@
 import logging
 
 import click
-import jsonschema
 import yaml
 from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 
 from .declaratives import Base
 from .manager import Manager
 from .utils import setup_db_conn, setup_logging
-from .validation import SCHEMA
+from . import validation
 
 
 logger = logging.getLogger("lsst.dbb.buffmngrs.handoff")
@@ -103,14 +102,10 @@ def run(filename):
 def validate(filename):
     """Validate the configuration in FILENAME.
     """
-    with open(filename) as f:
-        configuration = yaml.safe_load(f)
     try:
-        jsonschema.validate(instance=configuration, schema=SCHEMA)
-    except jsonschema.ValidationError as ex:
-        raise ValueError(f"configuration error: {ex}.")
-    except jsonschema.SchemaError as ex:
-        raise ValueError(f"schema error: {ex}.")
+        validation.validate_file(filename)
+    except ValueError as ex:
+        raise ValueError(f"{ex}.")
 
 
 def main():
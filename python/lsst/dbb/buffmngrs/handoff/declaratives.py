@@ -25,6 +25,7 @@ from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     Interval,
     Numeric,
@@ -65,6 +66,12 @@ class File(Base):
     batches = relationship("Batch",
                            secondary=association_table,
                            back_populates="files")
+    __table_args__ = (
+        # Files are looked up either by their location or by their location
+        # and checksum, the index handles both as the former is its prefix.
+        Index("ix_files_relpath_filename_checksum",
+              "relpath", "filename", "checksum"),
+    )
 
 
 class Batch(Base):
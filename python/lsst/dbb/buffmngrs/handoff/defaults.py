@@ -48,7 +48,21 @@ class Defaults:
     """
 
     num_threads: int = 1
-    """Number of transfer threads to run concurrently.
+    """Number of file transfers to run concurrently.
+    """
+
+    finder_threads: int = 8
+    """Number of threads scanning directories in the buffer concurrently.
+    """
+
+    parallelism: int = 1
+    """Number of locations files are transferred from concurrently by a single
+    transfer thread.
+    """
+
+    checksum_workers: int = None
+    """Number of processes calculating checksums of new files concurrently.
+    If None, the number of CPUs will be used.
     """
 
     expiration_time: int = 86400
@@ -20,6 +20,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Definitions of command that need to be executed on the handoff site.
 """
+import concurrent.futures
+import errno
 import re
 import logging
 import os
@@ -29,6 +31,7 @@ import time
 from datetime import datetime
 from .abcs import Command
 from .messages import FileMsg
+from .utils import get_chunk
 
 
 __all__ = ["Finder", "Eraser", "Mover"]
@@ -44,8 +47,12 @@ class Finder(Command):
     ----------
     config : dict
         Configuration of the handoff site.
-    queue : queue.Queue
+    queue : queue.Queue or queue.SimpleQueue
         Container where the files found in the given directory will be stored.
+    exclude_list : list of str, optional
+        Regular expressions matching files which should be ignored.
+    num_threads : int, optional
+        Number of threads scanning directories concurrently, defaults to 1.
 
     Raises
     ------
@@ -53,7 +60,7 @@ class Finder(Command):
         If buffer is not specified, does not exists, or is not a directory.
     """
 
-    def __init__(self, config, queue, exclude_list=None):
+    def __init__(self, config, queue, exclude_list=None, num_threads=1):
         try:
             path = config["buffer"]
         except KeyError:
@@ -65,33 +72,81 @@ class Finder(Command):
         self.exclude_list = exclude_list
         if self.exclude_list is None:
             self.exclude_list = []
+        self.num_threads = num_threads
 
     def run(self):
         """Scan recursively the directory to find all files it contains.
+
+        Directories are scanned level by level.  If more than one thread is
+        allowed, directories at the same level are scanned concurrently which
+        helps on file systems with high metadata latency (e.g. NFS).
         """
-        for topdir, _, filenames in os.walk(self.root):
-            for name in filenames:
-                path = os.path.join(topdir, name)
-                tail = os.path.relpath(path, start=self.root)
-                dirname, basename = os.path.split(tail)
-                matches = [f"'{patt}'" for patt in self.exclude_list
-                           if re.search(patt, tail) is not None]
-                if matches:
-                    logger.debug("%s was excluded by pattern(s): "
-                                 "%s", path, ', '.join(matches))
-                    continue
-                try:
-                    status = os.stat(path)
-                except FileNotFoundError as ex:
-                    logger.error("%s", ex)
-                else:
-                    msg = FileMsg()
-                    msg.head = self.root
-                    msg.tail = dirname
-                    msg.name = basename
-                    msg.size = status.st_size
-                    msg.timestamp = status.st_mtime
-                    self.queue.put(msg)
+        level = [("", self.root)]
+        if self.num_threads < 2:
+            while level:
+                level = [sub for args in level for sub in self._scan(*args)]
+            return
+        with concurrent.futures.ThreadPoolExecutor(self.num_threads) as ex:
+            while level:
+                results = ex.map(lambda args: self._scan(*args), level)
+                level = [sub for subs in results for sub in subs]
+
+    def _scan(self, dirname, topdir):
+        """Find files in a directory.
+
+        Directories are scanned with os.scandir() as the file types it
+        provides usually do not require separate system calls.  On POSIX
+        systems, getting the file attributes still requires one per file.
+        Like os.walk(), it does not follow symbolic links to directories.
+
+        Parameters
+        ----------
+        dirname : `str`
+            Path to the directory, relative to the buffer.
+        topdir : `str`
+            Path to the directory.
+
+        Returns
+        -------
+        `list` [`tuple` [`str`, `str`]]
+            Relative and full paths to the subdirectories of the directory.
+        """
+        subdirs = []
+        try:
+            with os.scandir(topdir) as it:
+                entries = list(it)
+        except OSError as ex:
+            logger.error("%s", ex)
+            return subdirs
+        for entry in entries:
+            tail = os.path.join(dirname, entry.name)
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirs.append((tail, entry.path))
+                continue
+            matches = [f"'{patt}'" for patt in self.exclude_list
+                       if re.search(patt, tail) is not None]
+            if matches:
+                logger.debug("%s was excluded by pattern(s): "
+                             "%s", entry.path, ', '.join(matches))
+                continue
+            try:
+                status = entry.stat()
+            except FileNotFoundError as ex:
+                logger.error("%s", ex)
+            else:
+                msg = FileMsg()
+                msg.head = self.root
+                msg.tail = dirname
+                msg.name = entry.name
+                msg.size = status.st_size
+                msg.timestamp = status.st_mtime
+                self.queue.put(msg)
+        return subdirs
 
 
 class Mover(Command):
@@ -101,10 +156,12 @@ class Mover(Command):
     ----------
     config : dict
         Configuration of the handoff site.
-    inp : queue.Queue
+    inp : queue.Queue or queue.SimpleQueue
         Input message queue with files to move.
-    out : queue.Queue
+    out : queue.Queue or queue.SimpleQueue
         Output message queue with files that were moved.
+    chunk_size : int, optional
+        Number of files to grab from the input queue at once, defaults to 10.
 
     Raises
     ------
@@ -112,7 +169,7 @@ class Mover(Command):
        If holding area is not specified, does not exist, or is not a directory.
     """
 
-    def __init__(self, config, inp, out):
+    def __init__(self, config, inp, out, chunk_size=10):
         try:
             path = config["holding"]
         except KeyError:
@@ -126,25 +183,51 @@ class Mover(Command):
         self.root = path
         self.inp = inp
         self.out = out
+        self.chunk_size = chunk_size
 
     def run(self):
         """Move files from the buffer to the holding area.
         """
-        while not self.inp.empty():
-            msg = self.inp.get(block=False)
-            os.makedirs(os.path.join(self.root, msg.tail), exist_ok=True)
-            src = os.path.join(msg.head, msg.tail, msg.name)
-            dst = os.path.join(self.root, msg.tail, msg.name)
-            logger.debug("Moving '%s' to '%s'.", src, dst)
+        while True:
+            msgs = get_chunk(self.inp, size=self.chunk_size)
+            if not msgs:
+                break
+            self._move_batch(msgs)
+
+    def _move_batch(self, msgs):
+        """Move a batch of files to the holding area.
+
+        Each of the required subdirectories of the holding area is created
+        only once per batch.
+
+        Parameters
+        ----------
+        msgs : `list` [`FileMsg`]
+            Files to move.
+        """
+        mapping = {}
+        for msg in _order_batch(msgs):
+            mapping.setdefault(msg.tail, []).append(msg)
+        for tail, items in mapping.items():
+            dirname = os.path.join(self.root, tail)
             try:
-                shutil.move(src, dst)
+                os.makedirs(dirname, exist_ok=True)
             except OSError as ex:
-                logger.warning("Cannot move '%s': %s.", src, ex)
+                logger.warning("Cannot create '%s': %s.", dirname, ex)
                 continue
-            else:
-                msg.head = self.root
-                msg.timestamp = datetime.now().timestamp()
-                self.out.put(msg)
+            for msg in items:
+                src = os.path.join(msg.head, msg.tail, msg.name)
+                dst = os.path.join(dirname, msg.name)
+                logger.debug("Moving '%s' to '%s'.", src, dst)
+                try:
+                    _move(src, dst)
+                except OSError as ex:
+                    logger.warning("Cannot move '%s': %s.", src, ex)
+                    continue
+                else:
+                    msg.head = self.root
+                    msg.timestamp = datetime.now().timestamp()
+                    self.out.put(msg)
 
 
 class Eraser(Command):
@@ -185,18 +268,36 @@ class Eraser(Command):
     def run(self):
         """Remove old, empty directories from the buffer.
         """
+        # Find empty directories in a single pass over the directory tree,
+        # their modification times are taken from the entries of their
+        # parent directories.
         empty_dirs = []
-        for topdir, subdirs, _ in os.walk(self.root, topdown=False):
-            for name in subdirs:
-                path = os.path.join(topdir, name)
-                if len(os.listdir(path)) == 0:
-                    empty_dirs.append(path)
-        logger.debug("Empty directories found: '%s'.", empty_dirs)
+        dirs = [(self.root, None)]
+        while dirs:
+            topdir, parent = dirs.pop()
+            empty = True
+            try:
+                with os.scandir(topdir) as it:
+                    for entry in it:
+                        empty = False
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append((entry.path, entry))
+            except OSError as ex:
+                logger.warning("Cannot scan '%s': %s", topdir, ex)
+                continue
+            if empty and parent is not None:
+                empty_dirs.append(parent)
+        logger.debug("Empty directories found: '%s'.",
+                     [entry.path for entry in empty_dirs])
 
         now = time.time()
-        for path in empty_dirs:
-            stat_info = os.stat(path)
-            mod_time = stat_info.st_mtime
+        for entry in empty_dirs:
+            path = entry.path
+            try:
+                mod_time = entry.stat(follow_symlinks=False).st_mtime
+            except OSError as ex:
+                logger.warning("Cannot check '%s': %s", path, ex)
+                continue
             duration = now - mod_time
             if duration > self.exp_time:
                 try:
@@ -205,3 +306,52 @@ class Eraser(Command):
                     logger.warning("Cannot remove '%s': %s", path, ex)
                 else:
                     logger.debug("Directory '%s' removed successfully.", path)
+
+
+def _order_batch(msgs):
+    """Sort files by their location on the storage device.
+
+    Accessing files in the order of their inode numbers rather than in a
+    random one lets the file system read its metadata sequentially.
+
+    Parameters
+    ----------
+    msgs : `list` [`FileMsg`]
+        Files to sort.
+
+    Returns
+    -------
+    `list` [`FileMsg`]
+        The files sorted by device and inode numbers.  Files which cannot
+        be accessed are placed at the beginning.
+    """
+    def key(msg):
+        path = os.path.join(msg.head, msg.tail, msg.name)
+        try:
+            status = os.stat(path)
+        except OSError:
+            return 0, 0
+        return status.st_dev, status.st_ino
+    return sorted(msgs, key=key)
+
+
+def _move(src, dst):
+    """Move a file.
+
+    If both locations are on the same file system, the file is simply
+    renamed.  Otherwise, it is copied to the new location and removed from
+    the old one.
+
+    Parameters
+    ----------
+    src : `str`
+        Current path to the file.
+    dst : `str`
+        New path to the file.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
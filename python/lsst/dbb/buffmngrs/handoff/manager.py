@@ -26,9 +26,8 @@ import queue
 import time
 from dataclasses import asdict
 from datetime import datetime, timedelta
-from threading import Thread
 
-from sqlalchemy import tuple_
+from sqlalchemy import insert, tuple_
 from sqlalchemy.exc import DBAPIError, SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 
@@ -36,7 +35,7 @@ from . import Eraser, Finder, Macro, Mover, Porter, Wiper
 from .declaratives import Batch, File
 from .defaults import Defaults
 from .messages import FileMsg
-from .utils import get_checksum, get_chunk, setup_db_conn
+from .utils import batched, checksum_many, drain, setup_db_conn
 
 
 __all__ = ["Manager"]
@@ -66,7 +65,13 @@ class Manager:
         # Set up database connection.
         config = configuration["database"]
         engine = setup_db_conn(config)
-        Session = sessionmaker(bind=engine)
+
+        # Changes are committed explicitly after each chunk of work, so there
+        # is no need for the session to flush pending objects before every
+        # query or to reload instances after each commit.
+        Session = sessionmaker(bind=engine,
+                               autoflush=False,
+                               expire_on_commit=False)
         self.session = Session()
 
         # Initialize general settings.
@@ -74,22 +79,25 @@ class Manager:
         settings = asdict(Defaults())
         if config is not None:
             settings.update(config)
-        self.num_threads = settings["num_threads"]
         self.pause = settings["pause"]
+        self.checksum_workers = settings["checksum_workers"]
 
-        # Initialize message queues.
-        self.discovered = queue.Queue()
-        self.pending = queue.Queue()
-        self.processed = queue.Queue()
-        self.completed = queue.Queue()
+        # Initialize message queues.  None of the tasks uses task_done() or
+        # join(), so the queues do not need to track unfinished tasks.
+        self.discovered = queue.SimpleQueue()
+        self.pending = queue.SimpleQueue()
+        self.processed = queue.SimpleQueue()
+        self.completed = queue.SimpleQueue()
 
-        self.transfers = queue.Queue()
+        self.transfers = queue.SimpleQueue()
 
         # Define tasks related to managing the buffer.
         handoff = configuration["handoff"]
         self.finder = Finder(handoff, self.discovered,
-                             exclude_list=settings["exclude_list"])
-        mover = Mover(handoff, self.processed, self.completed)
+                             exclude_list=settings["exclude_list"],
+                             num_threads=settings["finder_threads"])
+        mover = Mover(handoff, self.processed, self.completed,
+                      chunk_size=settings["chunk_size"])
         eraser = Eraser(handoff, exp_time=settings["expiration_time"])
         self.cleaner = Macro()
         self.cleaner.add(mover)
@@ -99,7 +107,9 @@ class Manager:
         endpoint = configuration["endpoint"]
         self.porter = Porter(endpoint, self.pending, self.transfers,
                              chunk_size=settings["chunk_size"],
-                             timeout=settings["timeout"])
+                             timeout=settings["timeout"],
+                             num_workers=settings["num_threads"],
+                             parallelism=settings["parallelism"])
         self.wiper = Wiper(endpoint)
 
     def run(self):
@@ -145,14 +155,7 @@ class Manager:
             # transfer attempts.
             logger.info("Transferring files.")
             start = time.time()
-            threads = []
-            num_threads = min(self.num_threads, self.pending.qsize())
-            for _ in range(num_threads):
-                t = Thread(target=self.porter.run)
-                t.start()
-                threads.append(t)
-            for t in threads:
-                t.join()
+            self.porter.run()
             self.wiper.run()
             end = time.time()
             duration = end - start
@@ -190,44 +193,58 @@ class Manager:
 
         Parameters
         ----------
-        inp : queue.Queue
+        inp : queue.Queue or queue.SimpleQueue
             Input queue with file items representing files found in the buffer.
-        out : queue.Queue
+        out : queue.Queue or queue.SimpleQueue
             Output queue for file items representing tracked files.
         chunk_size : `int`, optional
             Number of items to grab from the queue, defaults to 10.
         """
-        while not inp.empty():
-            items = get_chunk(inp, size=chunk_size)
+        # Calculate checksums of all files in parallel first to check which
+        # of them are already tracked with a single query per chunk.
+        discovered = drain(inp)
+        paths = [os.path.join(item.head, item.tail, item.name)
+                 for item in discovered]
+        checksums = checksum_many(paths, workers=self.checksum_workers)
+
+        # Files which checksums couldn't be calculated are skipped, they will
+        # be picked up again during one of the next scans.
+        discovered = [item for item, path in zip(discovered, paths)
+                      if checksums[path] is not None]
+
+        for items in batched(discovered, chunk_size):
+            keys = [(item.tail, item.name,
+                     checksums[os.path.join(item.head, item.tail, item.name)])
+                    for item in items]
+            try:
+                rows = self.session.\
+                    query(File.relpath, File.filename, File.checksum).\
+                    filter(tuple_(File.relpath, File.filename, File.checksum).
+                           in_(keys)).all()
+            except (DBAPIError, SQLAlchemyError) as ex:
+                logger.error("checking if files are tracked failed: %s", ex)
+                self.session.rollback()
+                continue
+            known = {tuple(row) for row in rows}
 
-            tracked, untracked = [], []
-            for item in items:
-                path = os.path.join(item.head, item.tail, item.name)
-                checksum = get_checksum(path)
-                try:
-                    file_ = self.session.query(File).\
-                        filter(File.relpath == item.tail,
-                               File.filename == item.name,
-                               File.checksum == checksum).first()
-                except (DBAPIError, SQLAlchemyError) as ex:
-                    logger.error("checking if file is tracked failed: %s", ex)
-                    self.session.rollback()
-                else:
-                    if file_ is not None:
-                        tracked.append(item)
-                    else:
-                        untracked.append(item)
-                        file_ = File(
-                            relpath=item.tail,
-                            filename=item.name,
-                            checksum=checksum,
-                            size_bytes=item.size,
-                            created_on=datetime.fromtimestamp(item.timestamp)
-                        )
-                        self.session.add(file_)
-
-            if untracked:
+            tracked, untracked, records = [], [], []
+            for item, key in zip(items, keys):
+                if key in known:
+                    tracked.append(item)
+                    continue
+                untracked.append(item)
+                relpath, filename, checksum = key
+                records.append({
+                    "relpath": relpath,
+                    "filename": filename,
+                    "checksum": checksum,
+                    "size_bytes": item.size,
+                    "created_on": datetime.fromtimestamp(item.timestamp)
+                })
+
+            if records:
                 try:
+                    self.session.execute(insert(File).values(records))
                     self.session.commit()
                 except (DBAPIError, SQLAlchemyError) as ex:
                     logger.error("adding new files failed: %s", ex)
@@ -245,15 +262,14 @@ class Manager:
 
         Parameters
         ----------
-        transfers : queue.Queue
+        transfers : queue.Queue or queue.SimpleQueue
             Input queue with transfer items.
-        files : queue.Queue
+        files : queue.Queue or queue.SimpleQueue
             Output queue for file items.
         chunk_size : `int`, optional
             Number of items to grab from the queue, defaults to 10.
         """
-        while not transfers.empty():
-            items = get_chunk(transfers, size=chunk_size)
+        for items in batched(drain(transfers), chunk_size):
 
             batches = []
             transferred = []
@@ -298,13 +314,12 @@ class Manager:
 
         Parameters
         ----------
-        inp : queue.Queue
+        inp : queue.Queue or queue.SimpleQueue
             Input queue with file items.
         chunk_size : `int`, optional
             Number of items to grab from the queue, defaults to 10.
         """
-        while not inp.empty():
-            items = get_chunk(inp, size=chunk_size)
+        for items in batched(drain(inp), chunk_size):
 
             records = []
             for item in items:
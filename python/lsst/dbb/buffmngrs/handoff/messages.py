@@ -20,10 +20,16 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Specifications of messages allowed in inter-thread/command communication.
 """
+import sys
 from dataclasses import dataclass
 
 
-@dataclass
+# Messages are created in bulk, one per file, so let them use slots instead
+# of per-instance dictionaries where the Python version supports it.
+_options = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_options)
 class FileMsg:
     """A message containing information about a file.
     """
@@ -49,7 +55,7 @@ class FileMsg:
     """
 
 
-@dataclass
+@dataclass(**_options)
 class TransferMsg:
     """A message containing information about a transfer batch.
     """
@@ -21,14 +21,21 @@
 """Definitions of commands that need to be executed on the endpoint site.
 """
 
-import datetime
+import asyncio
+import atexit
+import collections
 import dataclasses
 import errno
+import functools
 import logging
 import os
-import re
 import shlex
+import shutil
+import signal
+import string
 import subprocess
+import tempfile
+import time
 from .abcs import Command
 from .messages import TransferMsg
 from .utils import get_chunk
@@ -37,7 +44,41 @@ __all__ = ['Porter', 'Wiper']
 
 
 logger = logging.getLogger(__name__)
-keywords = {"batch", "command", "dest", "file"}
+keywords = {"batch", "command", "dest", "file", "srcdir"}
+
+# Limits used when dividing files sharing the same location into batches in
+# the batch mode: the maximal number of files and their total size (in bytes)
+# in a batch, and the size above which a file is always transferred alone.
+BATCH_MAX_FILES = 100
+BATCH_MAX_SIZE = 1024 ** 3
+LARGE_FILE_SIZE = 100 * 1024 ** 2
+
+# Maximal number of directories on the endpoint site Porter remembers as
+# already created.
+KNOWN_DIRS_LIMIT = 1024
+
+# Maximal length (in characters) of a shell command executed on the endpoint
+# site.  The command is passed to the remote shell as a single argument and
+# Linux limits the length of a single argument to 128 KiB.
+COMMAND_MAX_LENGTH = 100000
+
+# Maximal size (in bytes) of the standard error of a command kept in memory and
+# the size of blocks its output is read by.
+ERROR_MAX_SIZE = 64 * 1024
+BLOCK_SIZE = 8192
+
+# SSH clients which accept OpenSSH options, i.e., '-o option=value'.
+SSH_CLIENTS = {"scp", "sftp", "ssh"}
+
+# Options making SSH clients reuse a single, persistent connection to the
+# endpoint site instead of establishing a new one for each command.  The
+# control socket is shared by all commands in the current process and is
+# kept in a private directory (see get_control_dir()) as whoever creates it
+# first can act as the endpoint site.
+MULTIPLEX_OPTIONS = [
+    "ControlMaster=auto",
+    "ControlPersist=600",
+]
 
 
 class Porter(Command):
@@ -55,17 +96,23 @@ class Porter(Command):
     ----------
     config : dict
         Configuration of the endpoint where files should be transferred to.
-    pending : queue.Queue
+    pending : queue.Queue or queue.SimpleQueue
         Files that need to be transferred.
-    completed : queue.Queue
+    completed : queue.Queue or queue.SimpleQueue
         Files that were transferred successfully.
     chunk_size : int, optional
-        Number of files to process in a single iteration of the transfer
-        loop, defaults to 1.
+        Maximal number of files to process in a single iteration of the
+        transfer loop, defaults to 1.  The number is halved after each
+        iteration with failed transfers and doubled after each successful one.
     timeout : int, optional
         Time (in seconds) after which the child process executing a bash
         command will be terminated. If None (default), the command will wait
         indefinitely for the child process to complete.
+    num_workers : int, optional
+        Number of workers transferring files concurrently, defaults to 1.
+    parallelism : int, optional
+        Maximal number of locations a worker transfers files from
+        concurrently, defaults to 1.
 
     Raises
     ------
@@ -73,7 +120,8 @@ class Porter(Command):
         If endpoint's specification is invalid.
     """
 
-    def __init__(self, config, pending, completed, chunk_size=1, timeout=None):
+    def __init__(self, config, pending, completed, chunk_size=1, timeout=None,
+                 num_workers=1, parallelism=1):
         required = {"user", "host", "buffer", "commands"}
         missing = required - set(config)
         if missing:
@@ -81,13 +129,17 @@ class Porter(Command):
             logger.critical(msg)
             raise ValueError(msg)
 
-        self.cmds = config["commands"]
+        self.cmds = dict(config["commands"])
         self.params = {k: v for k, v in config.items() if k != "commands"}
+        options = get_ssh_options(self.params)
+        if options:
+            self.cmds = {name: add_ssh_options(cmd, options)
+                         for name, cmd in self.cmds.items()}
 
         # Verify if all parameters in use were provided.
         actual = set(self.params)
         for cmd in self.cmds.values():
-            formal = set(re.findall(r"{(\w+)}", cmd))
+            formal = get_fields(cmd)
             remaining = formal - actual
             undefined = remaining - keywords
             if undefined:
@@ -99,33 +151,83 @@ class Porter(Command):
         # If the source in the transfer command is specified with keyword
         # 'file', a separate transfer attempt will be made for each file. If
         # the keyword 'batch' is used instead a single transfer attempt will
-        # be made for multiple files when possible.
-        self.batch_mode = False
-        if "batch" in self.cmds["transfer"]:
-            self.batch_mode = True
+        # be made for multiple files when possible.  The same applies if the
+        # keyword 'srcdir' is used, but the names of the files, relative to
+        # that directory, will be passed to the command on its standard input.
+        formal = get_fields(self.cmds["transfer"])
+        self.stdin_mode = "srcdir" in formal
+        self.batch_mode = "batch" in formal or self.stdin_mode
 
         # Once the transfer mode set for future reference, replace 'file/batch'
         # with generic 'source' to make generating concrete commands easier
         # later on.
         cmd = self.cmds["transfer"]
-        self.cmds["transfer"] = re.sub(r"(batch|file)", "source", cmd)
+        for keyword in ("{batch}", "{file}"):
+            cmd = cmd.replace(keyword, "{source}")
+        self.cmds["transfer"] = cmd
+
+        # Split the templates into arguments once, concrete commands are
+        # generated by formatting the arguments individually.  Parameters
+        # are substituted before the split, so a value consisting of multiple
+        # words, e.g. options of the transfer command, becomes multiple
+        # arguments.
+        self.args = {name: shlex.split(fill_template(cmd, self.params))
+                     for name, cmd in self.cmds.items()}
+
+        # If files are transferred to the endpoint site with rsync, the
+        # remote rsync can create the destination directory itself which
+        # saves a separate round trip to the endpoint site.
+        args = self.args["transfer"]
+        self.rsync_mkdir = (
+            os.path.basename(args[0]) == "rsync"
+            and any(":{dest}" in arg for arg in args)
+            and not any(arg.startswith("--rsync-path") for arg in args)
+        )
 
         self.chunk_size = chunk_size
+        self._current_chunk = chunk_size
         self.timeout = timeout
+        self.num_workers = num_workers
+        self.parallelism = parallelism
+
+        # Directories on the endpoint site which were created during the
+        # current run (the values are irrelevant).
+        self._known_dirs = collections.OrderedDict()
 
         self.todo = pending
         self.done = completed
 
     def run(self):
         """Transfer files to the endpoint site.
+
+        Workers transferring the files run concurrently in a single event
+        loop as they spend most of the time waiting for the child processes
+        executing the shell commands.
         """
-        buffer = self.params["buffer"]
-        stage = self.params.get("staging", buffer)
-        while not self.todo.empty():
-            # Grab a bunch of file items from the input queue.
-            files = get_chunk(self.todo, size=self.chunk_size)
+        # Empty directories may be removed from the endpoint site between
+        # runs (see Wiper), so forget about directories created previously.
+        self._known_dirs.clear()
+        asyncio.run(self._run())
+
+    async def _run(self):
+        """Start the workers and wait until all of them are finished.
+        """
+        workers = [self._work() for _ in range(self.num_workers)]
+        await asyncio.gather(*workers)
+
+    async def _work(self):
+        """Transfer files until there are no more files to transfer.
+        """
+        # Each worker limits the number of locations it transfers files from
+        # concurrently on its own, workers do not wait for each other.
+        slots = asyncio.Semaphore(self.parallelism)
+        while True:
+            # Grab a bunch of file items from the input queue. The queue is
+            # filled before the transfers start, so an empty chunk means there
+            # is nothing left to do.
+            files = get_chunk(self.todo, size=self._current_chunk)
             if not files:
-                continue
+                break
 
             # Group files based on their location as only the files sharing the
             # same location can be transferred as a group with a single
@@ -135,133 +237,249 @@ class Porter(Command):
                 head, tail, *rest = dataclasses.astuple(item)
                 mapping.setdefault((head, tail), []).append(item)
 
-            # Transfer files to the handoff site to the endpoint site.
-            for location, files in mapping.items():
-                head, tail = location
-
-                filenames = [item.name for item in files]
-                sizes = {item.name: item.size for item in files}
-
-                # Divide files into batches. If batch mode is disabled, each
-                # batch will consist of a single file.
-                batch_size = len(filenames) if self.batch_mode else 1
-                batches = [filenames[i:i + batch_size]
-                           for i in range(0, len(filenames), batch_size)]
-
-                # Create corresponding number of transfer messages to put in
-                # the output queue.
-                transfers = [TransferMsg() for _ in batches]
-                for batch, transfer in zip(batches, transfers):
-                    transfer.files = tuple((head, tail, fn) for fn in batch)
-                    transfer.size = sum(sizes[fn] for fn in batch)
-
-                # 1. PRE-TRANSFER actions
-                # -----------------------
-                dest = os.path.join(stage, tail)
-                relocated = []
-
-                # Create a relevant subdirectory in the staging area and
-                # record time metrics, exit status, and possible error in each
-                # transfer message.
-                tpl = self.cmds["remote"]
-                cmd = tpl.format(**self.params, command=f"mkdir -p {dest}")
-                start = datetime.datetime.now()
-                status, _, stderr, dur = execute(cmd, timeout=self.timeout)
-                for transfer in transfers:
-                    transfer.pre_start = start.timestamp()
-                    transfer.pre_duration = dur.total_seconds()
-                    transfer.status = status
-                    transfer.error = stderr
-                if status != 0:
-                    self._flush(transfers)
-                    logger.warning("'%s' failed with error: '%s'", cmd, stderr)
-                    continue
+            # Transfer files from the handoff site to the endpoint site.
+            # Files from different locations are transferred concurrently.
+            tasks = [self._transfer(slots, head, tail, items)
+                     for (head, tail), items in mapping.items()]
+            results = await asyncio.gather(*tasks)
 
-                # 2. TRANSFER
-                # -----------
-                tpl = self.cmds["transfer"]
-                for batch, transfer in zip(batches, transfers):
-                    src = " ".join([os.path.join(head, tail, name)
-                                    for name in batch])
-                    cmd = tpl.format(**self.params, source=src, dest=dest)
-                    start = datetime.datetime.now()
-                    status, _, stderr, dur = execute(cmd, timeout=self.timeout)
-                    transfer.trans_start = start.timestamp()
-                    transfer.trans_duration = dur.total_seconds()
-                    transfer.status = status
-                    transfer.error = stderr
-
-                    if status != 0:
-                        self._flush([transfer])
-                        logger.warning("'%s' failed with error: '%s'",
-                                       cmd, stderr)
-                        continue
-
-                    # If transfer successfully, calculate transfer rate.
-                    transfer.rate = transfer.size / dur.total_seconds()  # B/s
-                    transfer.rate /= pow(1024, 2)                        # MB/s
-
-                    relocated.append((batch, transfer))
-
-                # Recreate lists without items corresponding to failed
-                # transfers.
-                batches, transfers = [], []
-                for batch, transfer in relocated:
-                    batches.append(batch)
-                    transfers.append(transfer)
-                if not batches:
-                    continue
+            # Adjust the number of files grabbed at once: halve it if any
+            # transfer failed, double it otherwise (up to the chunk size).
+            if all(results):
+                size = min(2 * self._current_chunk, self.chunk_size)
+            else:
+                size = max(self._current_chunk // 2, 1)
+            self._current_chunk = size
 
-                # If files were transferred directly to the buffer on the
-                # endpoint site, skip the next step.
-                if stage == buffer:
-                    self._flush(transfers)
-                    continue
+    async def _transfer(self, slots, head, tail, files):
+        """Transfer files sharing the same location.
+
+        Parameters
+        ----------
+        slots : `asyncio.Semaphore`
+            Limit of concurrent transfers of the worker.
+        head : `str`
+            Root directory on the handoff site.
+        tail : `str`
+            Path to the files, relative to the root directory.
+        files : `list` [`FileMsg`]
+            Files to transfer.
+
+        Returns
+        -------
+        `bool`
+            True if all files were transferred successfully, False otherwise.
+        """
+        buffer = self.params["buffer"]
+        stage = self.params.get("staging", buffer)
+
+        # Directories holding the files on the handoff site, in the staging
+        # area and in the buffer on the endpoint site.  They are the same for
+        # all files, so paths to individual files are built by simply
+        # appending file names to them.
+        src_dir = os.path.join(head, tail)
+        stage_dir = os.path.join(stage, tail)
+        buffer_dir = os.path.join(buffer, tail)
+        src_prefix = os.path.join(src_dir, "")
+        stage_prefix = os.path.join(stage_dir, "")
+
+        async with slots:
+            filenames = [item.name for item in files]
+            sizes = {item.name: item.size for item in files}
+
+            # Divide files into batches. If batch mode is disabled, each
+            # batch will consist of a single file.
+            if self.batch_mode:
+                batches = self._make_batches(files)
+            else:
+                batches = [[fn] for fn in filenames]
+
+            # Create corresponding number of transfer messages to put in
+            # the output queue.
+            transfers = [TransferMsg() for _ in batches]
+            for batch, transfer in zip(batches, transfers):
+                transfer.files = tuple((head, tail, fn) for fn in batch)
+                transfer.size = sum(sizes[fn] for fn in batch)
+
+            # 1. PRE-TRANSFER actions
+            # -----------------------
+            dest = stage_dir
+            relocated = []
+
+            # Create relevant subdirectory in the staging area, unless
+            # rsync will do it, and record time metrics, exit status, and
+            # possible error in each transfer message.  The subdirectory
+            # in the buffer is created when files are moved there.
+            start = time.time()
+            if self.rsync_mkdir:
+                args, status, stderr, dur = [], 0, "", 0.0
+            else:
+                args, status, stderr, dur = await self._mkdir(dest)
+            _record(transfers, pre_start=start, pre_duration=dur,
+                    status=status, error=stderr)
+            if status != 0:
+                self._flush(transfers)
+                logger.warning("'%s' failed with error: '%s'",
+                               shlex.join(args), stderr)
+                return False
+
+            # 2. TRANSFER
+            # -----------
+            tpl = self.args["transfer"]
+            success = True
+            for batch, transfer in zip(batches, transfers):
+                src = [f"{src_prefix}{name}" for name in batch]
+                args = format_args(tpl, source=src, dest=dest,
+                                   srcdir=src_dir)
+                if self.rsync_mkdir:
+                    path = f"mkdir -p {shlex.quote(dest)} && rsync"
+                    args.insert(1, f"--rsync-path={path}")
+                data = None
+                if self.stdin_mode:
+                    data = "".join(f"{name}\n" for name in batch)
+                start = time.time()
+                status, _, stderr, dur = await execute_async(
+                    args, timeout=self.timeout, capture=False, input=data)
+                _record([transfer], trans_start=start, trans_duration=dur,
+                        status=status, error=stderr)
 
-                # 3. POST-TRANSFER actions
-                # ------------------------
-                dest = os.path.join(buffer, tail)
-                completed = []
-                total = datetime.timedelta()
-
-                # Create a relevant subdirectory in the buffer.
-                tpl = self.cmds["remote"]
-                cmd = tpl.format(**self.params, command=f"mkdir -p {dest}")
-                start = datetime.datetime.now()
-                status, _, stderr, dur = execute(cmd, timeout=self.timeout)
-                total += dur
-                for transfer in transfers:
-                    transfer.post_start = start.timestamp()
-                    transfer.post_duration = total.total_seconds()
-                    transfer.status = status
-                    transfer.error = stderr
                 if status != 0:
-                    self._flush(transfers)
-                    logger.warning("'%s' failed with error: '%s'", cmd, stderr)
+                    self._flush([transfer])
+                    logger.warning("'%s' failed with error: '%s'",
+                                   shlex.join(args), stderr)
+                    success = False
                     continue
 
-                # Move files from the staging area to the buffer.
-                tpl = self.cmds["remote"]
-                for batch, transfer in zip(batches, transfers):
-                    src = " ".join([os.path.join(stage, tail, name)
-                                    for name in batch])
-                    cmd = tpl.format(**self.params, command=f"mv {src} {dest}")
-                    start = datetime.datetime.now()
-                    status, _, stderr, dur = execute(cmd, timeout=self.timeout)
-                    transfer.post_start = start.timestamp()
-                    transfer.post_duration = (total + dur).total_seconds()
-                    transfer.status = status
-                    transfer.error = stderr
-
-                    if status != 0:
-                        self._flush([transfer])
-                        logger.warning("'%s' failed with error: '%s'",
-                                       cmd, stderr)
-                        continue
-
-                    completed.append(transfer)
-
+                # If transfer successfully, calculate transfer rate.
+                transfer.rate = transfer.size / dur  # B/s
+                transfer.rate /= pow(1024, 2)        # MB/s
+
+                relocated.append((batch, transfer))
+
+            # Recreate lists without items corresponding to failed
+            # transfers.
+            batches, transfers = [], []
+            for batch, transfer in relocated:
+                batches.append(batch)
+                transfers.append(transfer)
+            if not batches:
+                return False
+
+            # If files were transferred directly to the buffer on the
+            # endpoint site, skip the next step.
+            if stage == buffer:
+                self._flush(transfers)
+                return success
+
+            # 3. POST-TRANSFER actions
+            # ------------------------
+            dest = shlex.quote(buffer_dir)
+
+            # Move files from the staging area to the buffer creating the
+            # relevant subdirectory first if necessary.  Files from as many
+            # batches as the maximal length of a command allows are moved
+            # with a single command.
+            groups = []
+            group, length = [], 2 * len(dest)
+            for batch, transfer in zip(batches, transfers):
+                paths = [shlex.quote(f"{stage_prefix}{name}")
+                         for name in batch]
+                size = sum(len(path) + 1 for path in paths)
+                if group and length + size > COMMAND_MAX_LENGTH:
+                    groups.append(group)
+                    group, length = [], 2 * len(dest)
+                group.append((paths, transfer))
+                length += size
+            if group:
+                groups.append(group)
+
+            tpl = self.args["remote"]
+            for group in groups:
+                src = " ".join(p for paths, _ in group for p in paths)
+                cmd = f"mkdir -p {dest} && mv {src} {dest}"
+                args = format_args(tpl, command=cmd)
+                start = time.time()
+                status, _, stderr, dur = await execute_async(
+                    args, timeout=self.timeout, capture=False)
+                completed = [transfer for _, transfer in group]
+                _record(completed, post_start=start, post_duration=dur,
+                        status=status, error=stderr)
+                if status != 0:
+                    logger.warning("'%s' failed with error: '%s'",
+                                   shlex.join(args), stderr)
+                    success = False
                 self._flush(completed)
+        return success
+
+    async def _mkdir(self, *paths):
+        """Create directories on the endpoint site with a single command.
+
+        Directories which were already created during the current run are not
+        created again.
+
+        Parameters
+        ----------
+        *paths : `str`
+            Paths to the directories.
+
+        Returns
+        -------
+        (list, int, str, float)
+            Arguments of the shell command, its exit status, stderr, and
+            duration.
+        """
+        missing = []
+        for path in paths:
+            if path in self._known_dirs:
+                self._known_dirs.move_to_end(path)
+            else:
+                missing.append(path)
+        dirs = " ".join(shlex.quote(path) for path in missing or paths)
+        tpl = self.args["remote"]
+        args = format_args(tpl, command=f"mkdir -p {dirs}")
+        if not missing:
+            return args, 0, "", 0.0
+        status, _, stderr, dur = await execute_async(
+            args, timeout=self.timeout, capture=False)
+        if status == 0:
+            for path in missing:
+                self._known_dirs[path] = None
+            while len(self._known_dirs) > KNOWN_DIRS_LIMIT:
+                self._known_dirs.popitem(last=False)
+        return args, status, stderr, dur
+
+    @staticmethod
+    def _make_batches(items):
+        """Divide files into batches of a manageable size.
+
+        Small files are grouped together to amortize the overhead of starting
+        a transfer, large files are transferred individually.
+
+        Parameters
+        ----------
+        items : `list` [`FileMsg`]
+            Files sharing the same location.
+
+        Returns
+        -------
+        `list` [`list` [`str`]]
+            Names of the files in each batch.
+        """
+        batches = []
+        batch, total = [], 0
+        for item in sorted(items, key=lambda i: i.size):
+            if item.size > LARGE_FILE_SIZE:
+                batches.append([item.name])
+                continue
+            if batch and (len(batch) == BATCH_MAX_FILES
+                          or total + item.size > BATCH_MAX_SIZE):
+                batches.append(batch)
+                batch, total = [], 0
+            batch.append(item.name)
+            total += item.size
+        if batch:
+            batches.append(batch)
+        return batches
 
     def _flush(self, items):
         """Enqueue messages in the output queue.
@@ -272,7 +490,7 @@ class Porter(Command):
             List of items to enqueue in the output queue.
         """
         for item in items:
-            self.done.put(item)
+            self.done.put_nowait(item)
 
 
 class Wiper(Command):
@@ -302,8 +520,12 @@ class Wiper(Command):
             logger.critical(msg)
             raise ValueError(msg)
 
-        self.cmds = config["commands"]
+        self.cmds = dict(config["commands"])
         self.params = {k: v for k, v in config.items() if k != "commands"}
+        options = get_ssh_options(self.params)
+        if options:
+            self.cmds = {name: add_ssh_options(cmd, options)
+                         for name, cmd in self.cmds.items()}
 
         self.stage = self.params.get("staging", None)
 
@@ -318,47 +540,357 @@ class Wiper(Command):
         args = dict(command=f"find {self.stage} -type d -empty -mindepth 1 "
                             f"-delete")
         cmd = tpl.format(**self.params, **args)
-        status, _, stderr, _ = execute(cmd, timeout=self.time)
+        status, _, stderr, _ = execute(cmd, timeout=self.time, capture=False)
         if status != 0:
             logger.warning("Command '%s' failed with error: '%s'", cmd, stderr)
 
 
-def execute(cmd, timeout=None):
-    """Run a shell command.
+@functools.lru_cache(maxsize=64)
+def get_fields(template):
+    """Get names of the replacement fields used in a command template.
+
+    Parameters
+    ----------
+    template : `str`
+        Command template.
+
+    Returns
+    -------
+    `frozenset` [`str`]
+        Names of the replacement fields.
+
+    Raises
+    ------
+    ValueError
+        If the template is malformed, e.g., has unbalanced braces.
+    """
+    parsed = string.Formatter().parse(template)
+    return frozenset(name for _, name, _, _ in parsed if name)
+
+
+def fill_template(template, params):
+    """Substitute parameters in a command template, leaving keywords intact.
+
+    Parameters
+    ----------
+    template : `str`
+        Command template.
+    params : `dict`
+        Values of the parameters.
+
+    Returns
+    -------
+    `str`
+        The template in which only the keywords remain to be substituted.
+        Braces in the rest of it are escaped, so it can be formatted again.
+    """
+    def escape(text):
+        return text.replace("{", "{{").replace("}", "}}")
+
+    formatter = string.Formatter()
+    parts = []
+    for text, name, spec, conv in formatter.parse(template):
+        parts.append(escape(text))
+        if name is None:
+            continue
+        if name in keywords or name == "source":
+            conv = f"!{conv}" if conv else ""
+            spec = f":{spec}" if spec else ""
+            parts.append(f"{{{name}{conv}{spec}}}")
+            continue
+        value, _ = formatter.get_field(name, (), params)
+        value = formatter.convert_field(value, conv)
+        parts.append(escape(formatter.format_field(value, spec)))
+    return "".join(parts)
+
+
+def format_args(args, source=(), **params):
+    """Generate arguments of a concrete command from a split template.
+
+    Parameters
+    ----------
+    args : `list` [`str`]
+        Arguments of the command template, with parameters other than
+        keywords already substituted (see `fill_template`).
+    source : `list` [`str`], optional
+        Paths to the files to transfer.  An argument consisting solely of
+        the keyword 'source' is replaced by the paths, each becoming a
+        separate argument.
+    **params
+        Values of the other keywords used in the template.
+
+    Returns
+    -------
+    `list` [`str`]
+        Arguments of the command.
+    """
+    result = []
+    for arg in args:
+        if arg == "{source}":
+            result.extend(source)
+        else:
+            result.append(arg.format(source=" ".join(source), **params))
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def get_control_dir():
+    """Get the directory holding control sockets of persistent connections.
+
+    The directory is created on the first call and is accessible only to the
+    current user.  When the interpreter exits, the persistent connections are
+    closed and the directory is removed.
+
+    Returns
+    -------
+    `str`
+        Path to the directory.
+    """
+    path = tempfile.mkdtemp(prefix="dbb-handoff-")
+    atexit.register(_close_connections, path)
+    return path
+
+
+def get_ssh_options(config):
+    """Get OpenSSH options to use with SSH clients based on the configuration.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration of the endpoint site.
+
+    Returns
+    -------
+    `list` [`str`]
+        OpenSSH options in the form 'option=value'.
+    """
+    options = []
+    if config.get("multiplex", True):
+        options.extend(MULTIPLEX_OPTIONS)
+        options.append("ControlPath=" + os.path.join(get_control_dir(), "%C"))
+    cipher = config.get("ssh_cipher")
+    if cipher is not None:
+        options.append(f"Ciphers={cipher}")
+    options.extend(config.get("ssh_options") or [])
+    return options
+
+
+def add_ssh_options(cmd, options):
+    """Add OpenSSH options to a command invoking an SSH client.
 
     Parameters
     ----------
-    cmd : basestring
+    cmd : `str`
         String representing the command, its options and arguments.
+    options : `list` [`str`]
+        OpenSSH options in the form 'option=value'.
+
+    Returns
+    -------
+    `str`
+        The command with the options inserted right after the name of the
+        client.  For rsync, the options are passed to ssh it uses as the
+        remote shell, unless the command sets the remote shell itself.
+        Commands invoking other programs are returned unchanged.
+    """
+    prog, _, args = cmd.strip().partition(" ")
+    name = os.path.basename(prog)
+    opts = " ".join(f"-o {shlex.quote(opt)}" for opt in options)
+    if name == "rsync":
+        for arg in shlex.split(args):
+            if arg.startswith("--rsh") or (arg.startswith("-")
+                                           and not arg.startswith("--")
+                                           and "e" in arg[1:]):
+                return cmd
+        rsh = shlex.quote(f"ssh {opts}")
+        return f"{prog} --rsh={rsh} {args}"
+    if name not in SSH_CLIENTS:
+        return cmd
+    return f"{prog} {opts} {args}"
+
+
+def execute(cmd, timeout=None, capture=True, input=None):
+    """Run a shell command.
+
+    Parameters
+    ----------
+    cmd : `str` or `list` [`str`]
+        String representing the command, its options and arguments, or a
+        list of them.
     timeout : int, optional
         Time (in seconds) after which the child process executing a bash
         command will be terminated. If None (default), the command will wait
         indefinitely for the child process to complete.
+    capture : bool, optional
+        If False, the standard output of the command will be discarded
+        instead of being read into memory, only its standard error will be
+        captured. Defaults to True.
+    input : str, optional
+        Data to send to the standard input of the command.  If None
+        (default), nothing will be sent.
 
     Returns
     -------
-    (int, str, str, datetime.timedelta)
-        Shell command exit status, stdout, stderr, and duration.
+    (int, str, str, float)
+        Shell command exit status, stdout, stderr, and duration (in
+        seconds).  If the standard output was not captured, stdout is None.
+        Only the first 64 KiB of the standard error are returned.
     """
-    logger.debug("Executing %s.", cmd)
+    return asyncio.run(execute_async(cmd, timeout=timeout, capture=capture,
+                                     input=input))
+
+
+async def execute_async(cmd, timeout=None, capture=True, input=None):
+    """Run a shell command without blocking the event loop.
 
-    start = datetime.datetime.now()
-    args = shlex.split(cmd)
-    opts = dict(capture_output=True, timeout=timeout, check=True, text=True)
+    Parameters
+    ----------
+    cmd : `str` or `list` [`str`]
+        String representing the command, its options and arguments, or a
+        list of them.
+    timeout : int, optional
+        Time (in seconds) after which the child process executing a bash
+        command will be terminated. If None (default), the command will wait
+        indefinitely for the child process to complete.
+    capture : bool, optional
+        If False, the standard output of the command will be discarded
+        instead of being read into memory, only its standard error will be
+        captured. Defaults to True.
+    input : str, optional
+        Data to send to the standard input of the command.  If None
+        (default), nothing will be sent.
+
+    Returns
+    -------
+    (int, str, str, float)
+        Shell command exit status, stdout, stderr, and duration (in
+        seconds).  If the standard output was not captured, stdout is None.
+        Only the first 64 KiB of the standard error are returned.
+    """
+    args = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    logger.debug("Executing %s.", shlex.join(args))
+
+    start = time.monotonic_ns()
+    # The command runs in a new session, so all processes it started can be
+    # terminated together if it times out.  Otherwise, any of them could keep
+    # its output open and make waiting for the command hang.
+    opts = dict(stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+                stderr=subprocess.PIPE, start_new_session=True)
+    if input is not None:
+        opts.update(stdin=subprocess.PIPE)
+        input = input.encode()
+    proc = await asyncio.create_subprocess_exec(*args, **opts)
+
+    # Only the beginning of the standard error is kept, the rest is read
+    # and discarded so the command does not block on a full pipe.
+    stdout = bytearray() if capture else None
+    stderr = bytearray()
+    tasks = [_read(proc.stderr, stderr, limit=ERROR_MAX_SIZE)]
+    if capture:
+        tasks.append(_read(proc.stdout, stdout))
+    if input is not None:
+        tasks.append(_write(proc.stdin, input))
     try:
-        proc = subprocess.run(args, **opts)
-    except subprocess.CalledProcessError as ex:
-        status = errno.EREMOTEIO
-        stdout, stderr = ex.stdout, ex.stderr
-    except subprocess.TimeoutExpired as ex:
+        await asyncio.wait_for(asyncio.gather(*tasks, proc.wait()), timeout)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
         status = errno.ETIME
-        stdout, stderr = ex.stdout, ex.stderr
     else:
-        status = proc.returncode
-        stdout, stderr = proc.stdout, proc.stderr
-    end = datetime.datetime.now()
-    duration = end - start
-
-    logger.debug("Execution completed in %i: (status: %s, output: '%s', error:"
-                 " '%s').", duration.total_seconds(), status, stdout, stderr)
+        status = 0 if proc.returncode == 0 else errno.EREMOTEIO
+    if stdout is not None:
+        stdout = stdout.decode(errors="replace")
+    stderr = stderr.decode(errors="replace")
+    duration = (time.monotonic_ns() - start) / 1e9
+
+    logger.debug("Execution completed in %.2f sec: (status: %s, output: '%s',"
+                 " error: '%s').", duration, status, stdout, stderr)
     return status, stdout, stderr, duration
+
+
+def _close_connections(path):
+    """Close persistent SSH connections and remove their control sockets.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the directory with the control sockets.
+    """
+    try:
+        with os.scandir(path) as it:
+            sockets = [entry.path for entry in it]
+    except OSError:
+        return
+    for socket in sockets:
+        # The destination is required, but irrelevant as the path to the
+        # control socket has no tokens to expand.
+        args = ["ssh", "-o", f"ControlPath={socket}", "-O", "exit",
+                "localhost"]
+        try:
+            subprocess.run(args, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=10)
+        except (OSError, subprocess.SubprocessError) as ex:
+            logger.warning("closing connection '%s' failed: %s", socket, ex)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _record(messages, **fields):
+    """Set the same values of the given fields in multiple messages.
+
+    Parameters
+    ----------
+    messages : `list` [`TransferMsg`]
+        Messages to update.
+    **fields
+        Values of the fields to set.
+    """
+    for msg in messages:
+        for name, value in fields.items():
+            setattr(msg, name, value)
+
+
+async def _read(stream, buffer, limit=None):
+    """Read data from a stream until the end of file.
+
+    Parameters
+    ----------
+    stream : asyncio.StreamReader
+        The stream to read the data from.
+    buffer : bytearray
+        The buffer to store the data in.
+    limit : int, optional
+        Maximal number of bytes to store in the buffer, the remaining data
+        will be discarded.  If None (default), all data will be stored.
+    """
+    while True:
+        data = await stream.read(BLOCK_SIZE)
+        if not data:
+            break
+        if limit is None:
+            buffer += data
+        elif len(buffer) < limit:
+            buffer += data[:limit - len(buffer)]
+
+
+async def _write(stream, data):
+    """Write data to a stream and close it.
+
+    Parameters
+    ----------
+    stream : asyncio.StreamWriter
+        The stream to write the data to.
+    data : bytes
+        The data to write.
+    """
+    try:
+        stream.write(data)
+        await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # The command exited without reading all its input, its exit status
+        # will tell what happened.
+        pass
+    finally:
+        stream.close()
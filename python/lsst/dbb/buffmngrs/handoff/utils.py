@@ -20,17 +20,28 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """A collection of general purpose functions.
 """
+import concurrent.futures
+import functools
 import hashlib
 import importlib
 import logging
 import logging.handlers
+import os
 import queue
 import time
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 
 __all__ = [
+    "batched",
+    "checksum_many",
+    "drain",
     "get_checksum",
     "get_chunk",
     "run_continuously",
@@ -39,7 +50,106 @@ __all__ = [
 ]
 
 
-def get_checksum(path, method='blake2', block_size=4096):
+logger = logging.getLogger(__name__)
+
+
+# Available since Python 3.11, reads files in a loop implemented in C.
+_file_digest = getattr(hashlib, "file_digest", None)
+
+# Supported hash functions. All of them, except BLAKE3, are provided by
+# OpenSSL and use the specialized instructions of the CPU when available.
+_HASHERS = {
+    'blake2': hashlib.blake2b,
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+}
+if blake3 is not None:
+    _HASHERS['blake3'] = blake3.blake3
+
+# Minimal number of files for which checksums are calculated by a pool of
+# processes.  For fewer files, starting the processes usually takes longer
+# than calculating the checksums one by one.
+CHECKSUM_POOL_MIN_FILES = 16
+
+
+def batched(items, size):
+    """Split a list of items into consecutive chunks.
+
+    Parameters
+    ----------
+    items : `list`
+        Items to split.
+    size : `int`
+        Maximal number of items in a chunk.
+
+    Yields
+    ------
+    `list`
+        Next chunk of items.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def checksum_many(paths, method='blake2', workers=None):
+    """Calculate checksums for multiple files in parallel.
+
+    Parameters
+    ----------
+    paths : `list` [`str`]
+        Paths to the files.
+    method : `str`, optional
+        An algorithm to use for calculating files' hashes, see
+        `get_checksum` for supported algorithms.
+    workers : `int`, optional
+        Number of processes calculating checksums, defaults to the number of
+        CPUs.  Checksums of fewer than `CHECKSUM_POOL_MIN_FILES` files are
+        always calculated in the current process.
+
+    Returns
+    -------
+    `dict` [`str`, `str`]
+        Files' hashes keyed by their paths.  The hash is None if it couldn't
+        be calculated for a given file.
+    """
+    func = functools.partial(_get_checksum, method=method)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    if workers < 2 or len(paths) < CHECKSUM_POOL_MIN_FILES:
+        return dict(zip(paths, map(func, paths)))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers) as ex:
+            return dict(zip(paths, ex.map(func, paths, chunksize=32)))
+    except concurrent.futures.BrokenExecutor as ex:
+        logger.error("calculating checksums in parallel failed: %s", ex)
+        return dict(zip(paths, map(func, paths)))
+
+
+def drain(q):
+    """Grab all items from a queue.
+
+    Parameters
+    ----------
+    q : queue.Queue or queue.SimpleQueue
+        The queue to grab items from.
+
+    Returns
+    -------
+    `list`
+        Items grabbed from the queue.
+    """
+    items = []
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+
+def get_checksum(path, method='blake2', block_size=1024**2):
     """Calculate checksum for a file using BLAKE2 cryptographic hash function.
 
     Parameters
@@ -50,36 +160,56 @@ def get_checksum(path, method='blake2', block_size=4096):
         An algorithm to use for calculating file's hash. Supported algorithms
         include:
         * _blake2_: BLAKE2 cryptographic hash,
+        * _blake3_: BLAKE3 cryptographic hash (requires package `blake3`),
         * _md5_: traditional MD5 algorithm,
-        * _sha1_: SHA-1 cryptographic hash.
+        * _sha1_: SHA-1 cryptographic hash,
+        * _sha256_: SHA-256 cryptographic hash.
         By default or if unsupported method is provided, BLAKE2 algorithm wil
-        be used.
+        be used.  On CPUs with SHA extensions (e.g. Intel Ice Lake, AMD Zen)
+        SHA-256 is usually the fastest of them.
     block_size : `int`, optional
-        Size of the block
+        Size of the block (in bytes) to read the file by, defaults to 1 MiB.
+        Only used if `hashlib.file_digest` is not available (Python < 3.11).
 
     Returns
     -------
     `str`
         File's hash calculated using a given method.
     """
-    methods = {
-        'blake2': hashlib.blake2b,
-        'md5': hashlib.md5,
-        'sha1': hashlib.sha1,
-    }
-    hasher = methods.get(method, hashlib.blake2b)()
+    constructor = _HASHERS.get(method, hashlib.blake2b)
+    # Files in the buffer may be still written to, so they are read rather
+    # than mapped into memory.  Accessing a mapping of a file truncated in the
+    # meantime would kill the process with SIGBUS.
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(block_size), b""):
-            hasher.update(chunk)
+        if _file_digest is not None:
+            hasher = _file_digest(f, constructor)
+        else:
+            hasher = constructor()
+            for chunk in iter(lambda: f.read(block_size), b""):
+                hasher.update(chunk)
     return hasher.hexdigest()
 
 
+def _get_checksum(path, method):
+    """Calculate checksum for a file.
+
+    Unlike `get_checksum`, if the checksum can't be calculated, e.g., the file
+    was removed in the meantime, it returns None instead of raising an
+    exception.
+    """
+    try:
+        return get_checksum(path, method=method)
+    except (OSError, ValueError) as ex:
+        logger.error("calculating checksum of '%s' failed: %s", path, ex)
+        return None
+
+
 def get_chunk(q, size=10):
     """Grab a number of items from a queue.
 
     Parameters
     ----------
-    q : queue.Queue
+    q : queue.Queue or queue.SimpleQueue
         The queue to grab items from.
     size : int, optional
         Number of elements to grab from the queue, default to 10.
@@ -90,13 +220,12 @@ def get_chunk(q, size=10):
         Items grabbed from the queue.
     """
     chunk = []
+    append, get = chunk.append, q.get_nowait
     for _ in range(size):
         try:
-            item = q.get(block=False)
+            append(get())
         except queue.Empty:
             break
-        else:
-            chunk.append(item)
     return chunk
 
 
@@ -138,6 +267,8 @@ def setup_db_conn(config):
     engine = create_engine(config["engine"],
                            echo=config.get("echo", False),
                            poolclass=class_)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
     return engine
 
 
@@ -202,3 +333,24 @@ def setup_logging(options=None):
         kwargs["handlers"] = [handler(logfile, **opts)]
 
     logging.basicConfig(**kwargs)
+
+
+def _set_sqlite_pragmas(dbapi_conn, conn_record):
+    """Tune a new SQLite connection for frequent, small transactions.
+
+    Write-ahead logging with normal synchronization requires a single fsync
+    per checkpoint instead of two per commit.
+
+    Parameters
+    ----------
+    dbapi_conn : `sqlite3.Connection`
+        The DBAPI connection which was just created.
+    conn_record : `sqlalchemy.pool._ConnectionRecord`
+        The connection record (unused).
+    """
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
@@ -20,9 +20,16 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """A schema for validating configuration files.
 """
+import functools
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from types import MappingProxyType
 
 
-__all__ = ["SCHEMA"]
+__all__ = ["SCHEMA", "validate", "validate_file"]
 
 
 SCHEMA = {
@@ -42,6 +49,12 @@ SCHEMA = {
                 "user": {"type": "string"},
                 "host": {"type": "string"},
                 "buffer": {"type": "string"},
+                "multiplex": {"type": "boolean"},
+                "ssh_cipher": {"type": "string"},
+                "ssh_options": {
+                    "type": "array",
+                    "items": {"type": "string"}
+                },
                 "commands": {
                     "type": "object",
                     "properties": {
@@ -103,12 +116,26 @@ SCHEMA = {
                     "type": "integer",
                     "minimum": 1
                 },
+                "finder_threads": {
+                    "type": "integer",
+                    "minimum": 1
+                },
+                "parallelism": {
+                    "type": "integer",
+                    "minimum": 1
+                },
                 "timeout": {
                     "anyOf": [
                         {"type": "integer", "minimum": 1},
                         {"type": "null"}
                     ]
                 },
+                "checksum_workers": {
+                    "anyOf": [
+                        {"type": "integer", "minimum": 1},
+                        {"type": "null"}
+                    ]
+                },
                 "expiration_time": {
                     "type": "integer",
                     "minimum": 1
@@ -136,3 +163,160 @@ SCHEMA = {
     },
     "required": ["handoff", "endpoint"]
 }
+
+
+def _freeze(obj):
+    """Make a read-only copy of a JSON-like object.
+
+    Dictionaries are turned into read-only mappings with interned keys and
+    lists into tuples.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({sys.intern(key): _freeze(value)
+                                 for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(value) for value in obj)
+    return obj
+
+
+def _thaw(obj):
+    """Make a mutable copy of an object made read-only by `_freeze`.
+
+    Validation libraries (and the JSON encoder) expect dictionaries and
+    lists, they do not accept read-only mappings and tuples in their place.
+    """
+    if isinstance(obj, MappingProxyType):
+        return {key: _thaw(value) for key, value in obj.items()}
+    if isinstance(obj, tuple):
+        return [_thaw(value) for value in obj]
+    return obj
+
+
+# Validators are built from a frozen copy of the schema, so modifying the
+# public one does not affect them or the hash of the schema.  The public
+# schema remains a dictionary as validation libraries and the JSON encoder
+# do not accept read-only mappings.
+_SCHEMA = _freeze(SCHEMA)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_validator():
+    """Build a function validating configurations against the schema.
+
+    Validation libraries are slow to import and checking the schema against
+    the meta-schema as well as building the validator are expensive, so all
+    of it is done only once and only when a configuration actually needs to
+    be validated.  If available, the schema is compiled into a Python
+    function with `fastjsonschema` which validates configurations much
+    faster than `jsonschema`.
+
+    Returns
+    -------
+    (callable, type)
+        The function validating a configuration and the type of the
+        exception it raises if the configuration is invalid.
+
+    Raises
+    ------
+    ValueError
+        If the schema itself is invalid.
+    """
+    try:
+        import fastjsonschema
+    except ImportError:
+        pass
+    else:
+        try:
+            func = fastjsonschema.compile(_thaw(_SCHEMA))
+        except fastjsonschema.JsonSchemaDefinitionException as ex:
+            raise ValueError(f"schema error: {ex}") from ex
+        return func, fastjsonschema.JsonSchemaException
+
+    import jsonschema
+    schema = _thaw(_SCHEMA)
+    try:
+        jsonschema.Draft7Validator.check_schema(schema)
+    except jsonschema.SchemaError as ex:
+        raise ValueError(f"schema error: {ex.message}") from ex
+    validator = jsonschema.Draft7Validator(schema)
+    return validator.validate, jsonschema.ValidationError
+
+
+def validate(config):
+    """Validate a configuration against the schema.
+
+    Parameters
+    ----------
+    config : `dict`
+        The configuration to validate.
+
+    Raises
+    ------
+    ValueError
+        If the configuration or the schema is invalid.
+    """
+    func, error = _get_validator()
+    try:
+        func(config)
+    except error as ex:
+        raise ValueError(f"configuration error: {ex.message}") from ex
+
+
+# Files which were successfully validated are recorded in a cache along with
+# their modification time, size, and the hash of the schema so they do not
+# need to be validated again until any of them changes.
+SCHEMA_HASH = hashlib.sha1(
+    json.dumps(_thaw(_SCHEMA), sort_keys=True).encode()).hexdigest()
+CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "dbb_handoff", "validation.cache")
+
+
+def validate_file(path):
+    """Validate a configuration file against the schema.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the configuration file.
+
+    Raises
+    ------
+    ValueError
+        If the configuration or the schema is invalid.
+    """
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    entry = [status.st_mtime_ns, status.st_size, SCHEMA_HASH]
+
+    # Problems with the cache are not errors, the file will be simply
+    # validated again.
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if not isinstance(cache, dict):
+        cache = {}
+    if cache.get(path) == entry:
+        return
+
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    validate(config)
+
+    cache[path] = entry
+    try:
+        dirname = os.path.dirname(CACHE_FILE)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp, CACHE_FILE)
+        except OSError:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
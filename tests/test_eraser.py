@@ -27,15 +27,39 @@ import unittest
 from lsst.dbb.buffmngrs.handoff import Eraser
 
 
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _all_dirs(root):
+    """Find names of all subdirectories in a directory tree.
+    """
+    names = []
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                    names.append(entry.name)
+    return names
+
+
 class EraserTestCase(unittest.TestCase):
     """Test the command cleaning up the buffer on the handoff site.
     """
 
-    def setUp(self):
-        self.dir = tempfile.mkdtemp()
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(dir=_TMPDIR)
 
-    def tearDown(self):
-        shutil.rmtree(self.dir)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(dir=self.root)
 
     def testInvalidConfig(self):
         """Test if Eraser complains about invalid configuration.
@@ -60,10 +84,7 @@ class EraserTestCase(unittest.TestCase):
         cmd = Eraser(config)
         cmd.run()
 
-        dirs = []
-        for topdir, subdirs, files in os.walk(self.dir):
-            for d in subdirs:
-                dirs.append(d)
+        dirs = _all_dirs(self.dir)
         self.assertEqual(len(dirs), 1)
 
     def testExpiredDir(self):
@@ -76,10 +97,7 @@ class EraserTestCase(unittest.TestCase):
         cmd = Eraser(config, exp_time=1)
         cmd.run()
 
-        dirs = []
-        for top, subs, files in os.walk(self.dir):
-            for d in subs:
-                dirs.append(d)
+        dirs = _all_dirs(self.dir)
         self.assertEqual(len(dirs), 0)
 
     def testNonEmptyDir(self):
@@ -91,8 +109,5 @@ class EraserTestCase(unittest.TestCase):
             os.close(fd)
         time.sleep(2)
 
-        dirs = []
-        for top, subs, files in os.walk(self.dir):
-            for d in subs:
-                dirs.append(d)
+        dirs = _all_dirs(self.dir)
         self.assertEqual(len(dirs), 1)
@@ -19,24 +19,59 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
 import os
 import queue
 import shutil
 import tempfile
 import unittest
+import unittest.mock
 from lsst.dbb.buffmngrs.handoff import Finder
 
 
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _touch(dirname, name):
+    """Create an empty file.
+    """
+    fd = os.open(os.path.join(dirname, name), os.O_CREAT | os.O_WRONLY, 0o600)
+    os.close(fd)
+
+
+class _CountingEntry:
+    """A directory entry recording calls of its stat() method.
+    """
+
+    def __init__(self, entry, calls):
+        self._entry = entry
+        self._calls = calls
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def stat(self, **kwargs):
+        self._calls.append(self._entry.name)
+        return self._entry.stat(**kwargs)
+
+
 class ScannerTestCase(unittest.TestCase):
     """Test the command finding files in a give directory.
     """
 
-    def setUp(self):
-        self.queue = queue.Queue()
-        self.root = tempfile.mkdtemp()
+    @classmethod
+    def setUpClass(cls):
+        cls.base = tempfile.mkdtemp(dir=_TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.base)
 
-    def tearDown(self):
-        shutil.rmtree(self.root)
+    def setUp(self):
+        self.queue = queue.SimpleQueue()
+        self.root = tempfile.mkdtemp(dir=self.base)
 
     def testInvalidConfig(self):
         """Test if Scanner complains about an invalid configuration.
@@ -63,13 +98,72 @@ class ScannerTestCase(unittest.TestCase):
     def testNonEmptyDir(self):
         """Test if Scanner finds all files in a directory.
         """
-        leaf = tempfile.mkdtemp(dir=self.root)
-        files = dict([tempfile.mkstemp(dir=self.root)])
-        files.update(dict(tempfile.mkstemp(dir=leaf) for _ in range(2)))
-        for fd in files:
-            os.close(fd)
+        leaf = os.path.join(self.root, "leaf")
+        os.mkdir(leaf, 0o700)
+        _touch(self.root, "a")
+        _touch(leaf, "b")
+        _touch(leaf, "c")
 
         config = dict(buffer=self.root)
         s = Finder(config, self.queue)
         s.run()
         self.assertEqual(self.queue.qsize(), 3)
+
+    def testNonEmptyDirThreads(self):
+        """Test if Scanner finds all files using multiple threads.
+        """
+        for i in range(3):
+            leaf = os.path.join(self.root, f"leaf{i}")
+            os.mkdir(leaf, 0o700)
+            _touch(leaf, "a")
+
+        config = dict(buffer=self.root)
+        s = Finder(config, self.queue, num_threads=2)
+        s.run()
+        self.assertEqual(self.queue.qsize(), 3)
+
+    def testManyFiles(self):
+        """Test if Scanner finds all files in a larger directory tree.
+        """
+        for i in range(10):
+            leaf = os.path.join(self.root, f"leaf{i}")
+            os.mkdir(leaf, 0o700)
+            for j in range(100):
+                _touch(leaf, f"f{j}")
+
+        config = dict(buffer=self.root)
+        for num_threads in (1, 4):
+            with self.subTest(num_threads=num_threads):
+                q = queue.SimpleQueue()
+                s = Finder(config, q, num_threads=num_threads)
+                s.run()
+                self.assertEqual(q.qsize(), 1000)
+
+    def testStatCalls(self):
+        """Test if Scanner gets attributes of each file exactly once.
+
+        Directories are recognized from the types provided by the directory
+        entries, only files require a stat call.
+        """
+        leaf = os.path.join(self.root, "leaf")
+        os.mkdir(leaf, 0o700)
+        _touch(self.root, "a")
+        _touch(leaf, "b")
+        _touch(leaf, "c")
+
+        calls = []
+        scandir = os.scandir
+
+        @contextlib.contextmanager
+        def counting_scandir(path):
+            with scandir(path) as it:
+                yield (_CountingEntry(entry, calls) for entry in it)
+
+        config = dict(buffer=self.root)
+        s = Finder(config, self.queue)
+        err = AssertionError("Scanner must not call os.stat() directly")
+        with unittest.mock.patch("os.scandir", counting_scandir), \
+                unittest.mock.patch("os.stat", side_effect=err):
+            s.run()
+        self.assertEqual(self.queue.qsize(), 3)
+        self.assertEqual(sorted(calls), ["a", "b", "c"])
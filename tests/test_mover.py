@@ -28,30 +28,54 @@ from lsst.dbb.buffmngrs.handoff import Mover
 from lsst.dbb.buffmngrs.handoff.messages import FileMsg
 
 
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _all_files(root):
+    """Find names of all files in a directory tree.
+    """
+    names = set()
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    names.add(entry.name)
+    return names
+
+
 class MoverTestCase(unittest.TestCase):
     """Test the command moving files from the buffer to holding area.
     """
 
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(dir=_TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
     def setUp(self):
-        self.src = tempfile.mkdtemp()
-        self.dst = tempfile.mkdtemp()
+        self.src = tempfile.mkdtemp(dir=self.root)
+        self.dst = tempfile.mkdtemp(dir=self.root)
         files = dict([tempfile.mkstemp(dir=self.src)])
         for fd in files:
             os.close(fd)
         self.files = files.values()
 
-        self.inp = queue.Queue()
-        self.out = queue.Queue()
+        self.inp = queue.SimpleQueue()
+        self.out = queue.SimpleQueue()
         for path in self.files:
             path = os.path.relpath(path, start=self.src)
             tail, name = os.path.split(path)
             msg = FileMsg(head=self.src, tail=tail, name=name)
             self.inp.put(msg)
 
-    def tearDown(self):
-        shutil.rmtree(self.src)
-        shutil.rmtree(self.dst)
-
     def testInvalidConfig(self):
         """Test if Mover complains about an invalid configuration.
         """
@@ -73,14 +97,8 @@ class MoverTestCase(unittest.TestCase):
         cmd = Mover(config, self.inp, self.out)
         cmd.run()
 
-        src = set()
-        for top, subs, files in os.walk(self.src):
-            for f in files:
-                src.add(f)
-        dst = set()
-        for top, subs, files in os.walk(self.dst):
-            for f in files:
-                dst.add(f)
+        src = _all_files(self.src)
+        dst = _all_files(self.dst)
         ref = set([os.path.relpath(p, start=self.src) for p in self.files])
         self.assertEqual(len(src), 0)
         self.assertEqual(len(dst), 1)
@@ -19,42 +19,88 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import errno
 import getpass
 import os
 import queue
+import shlex
 import shutil
 import tempfile
+import time
 import unittest
 from lsst.dbb.buffmngrs.handoff import Porter
+from lsst.dbb.buffmngrs.handoff.messages import FileMsg
+from lsst.dbb.buffmngrs.handoff.remote import get_control_dir
+from lsst.dbb.buffmngrs.handoff.utils import drain
+
+
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+_USER = getpass.getuser()
+_HOST = "localhost"
+
+# Commands meant for the endpoint site are executed locally, so the tests do
+# not need a running SSH server.
+_REMOTE = 'sh -c "{command}"'
+
+
+def _all_files(root):
+    """Find names of all files in a directory tree.
+    """
+    names = set()
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    names.add(entry.name)
+    return names
 
 
 class PorterTestCase(unittest.TestCase):
     """Test the command transferring files between handoff and endpoint sites.
     """
 
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(dir=_TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
     def setUp(self):
-        self.src = tempfile.mkdtemp()
-        self.dst = tempfile.mkdtemp()
-        self.stg = tempfile.mkdtemp()
-        self.user = getpass.getuser()
-        self.host = "localhost"
+        self.src = tempfile.mkdtemp(dir=self.root)
+        self.dst = tempfile.mkdtemp(dir=self.root)
+        self.stg = tempfile.mkdtemp(dir=self.root)
+        self.user = _USER
+        self.host = _HOST
         sub = tempfile.mkdtemp(dir=self.src)
         src = dict([tempfile.mkstemp(dir=self.src)])
         src.update(dict(tempfile.mkstemp(dir=sub) for _ in range(2)))
         for fd in src:
             os.close(fd)
 
-        self.todo = queue.Queue()
+        self.todo = queue.SimpleQueue()
         for path in src.values():
             tail = os.path.relpath(path, start=self.src)
             dn, bn = os.path.split(tail)
-            self.todo.put((self.src, dn, bn))
-        self.done = queue.Queue()
+            status = os.stat(path)
+            msg = FileMsg(head=self.src, tail=dn, name=bn,
+                          size=status.st_size, timestamp=status.st_mtime)
+            self.todo.put(msg)
+        self.done = queue.SimpleQueue()
 
-    def tearDown(self):
-        shutil.rmtree(self.src)
-        shutil.rmtree(self.dst)
-        shutil.rmtree(self.stg)
+    def _config(self, transfer):
+        """Create a configuration executing the commands locally.
+        """
+        return dict(buffer=self.dst, staging=self.stg, user=self.user,
+                    host=self.host,
+                    commands=dict(remote=_REMOTE, transfer=transfer))
 
     def testInvalidConfig(self):
         """Test if Porter complains about an invalid configurations.
@@ -71,23 +117,159 @@ class PorterTestCase(unittest.TestCase):
         args = [config, self.todo, self.done]
         self.assertRaises(ValueError, Porter, *args)
 
-    @unittest.skip("needs a running sshd")
+    def testControlPath(self):
+        """Test if control sockets are kept in a private directory.
+        """
+        config = dict(buffer=self.dst, staging=self.stg, user=self.user,
+                      host=self.host,
+                      commands={"remote": "ssh {user}@{host} \"{command}\"",
+                                "transfer": "scp {file} {host}:{dest}"})
+        cmd = Porter(config, self.todo, self.done)
+
+        path = os.path.join(get_control_dir(), "%C")
+        for args in cmd.args.values():
+            self.assertIn(f"ControlPath={path}", args)
+        status = os.stat(get_control_dir())
+        self.assertEqual(status.st_mode & 0o777, 0o700)
+        self.assertEqual(status.st_uid, os.getuid())
+
+    def testRsyncOptions(self):
+        """Test if OpenSSH options are passed to rsync's remote shell.
+        """
+        config = self._config("rsync -a {file} {user}@{host}:{dest}")
+        cmd = Porter(config, self.todo, self.done)
+        path = os.path.join(get_control_dir(), "%C")
+        rsh = shlex.split(cmd.args["transfer"][1].partition("=")[2])
+        self.assertEqual(cmd.args["transfer"][1].partition("=")[0], "--rsh")
+        self.assertEqual(rsh[0], "ssh")
+        self.assertIn(f"ControlPath={path}", rsh)
+
+        config = self._config("rsync -a -e ssh {file} {user}@{host}:{dest}")
+        cmd = Porter(config, self.todo, self.done)
+        self.assertEqual(cmd.args["transfer"][:4],
+                         ["rsync", "-a", "-e", "ssh"])
+
+    def testSshOptions(self):
+        """Test if OpenSSH options with spaces are passed as single arguments.
+        """
+        option = "ProxyCommand=ssh -W %h:%p bastion"
+        config = dict(buffer=self.dst, staging=self.stg, user=self.user,
+                      host=self.host, multiplex=False, ssh_options=[option],
+                      commands={"remote": "ssh {user}@{host} \"{command}\"",
+                                "transfer": "scp {file} {host}:{dest}"})
+        cmd = Porter(config, self.todo, self.done)
+        for args in cmd.args.values():
+            self.assertEqual(args[1:3], ["-o", option])
+
+    def testMultiWordParameter(self):
+        """Test if a parameter with multiple words becomes multiple arguments.
+        """
+        config = self._config("bbcp {opts} {file} {dest}")
+        config["opts"] = "-s 16 -w 8M"
+        cmd = Porter(config, self.todo, self.done)
+        self.assertEqual(cmd.args["transfer"],
+                         ["bbcp", "-s", "16", "-w", "8M", "{source}",
+                          "{dest}"])
+
+    def testEscapedBraces(self):
+        """Test if escaped braces in a command template are preserved.
+        """
+        config = self._config("sh -c 'test {{}} = {{}} && cp $0 $1' "
+                              "{file} {dest}")
+        cmd = Porter(config, self.todo, self.done)
+        cmd.run()
+
+        src = _all_files(self.src)
+        dst = _all_files(self.dst)
+        self.assertEqual(src, dst)
+        msgs = drain(self.done)
+        self.assertTrue(all(msg.status == 0 for msg in msgs))
+
     def testRun(self):
         """Test if Porter transfers files between handoff and endpoint sites.
         """
-        config = dict(buffer=self.dst, staging=self.stg, user=self.user,
-                      host=self.host)
+        config = self._config("cp {file} {dest}")
         cmd = Porter(config, self.todo, self.done)
         cmd.run()
 
-        src = set()
-        for top, subs, names in os.walk(self.src):
-            for name in names:
-                src.add(name)
-        dst = set()
-        for top, subs, names in os.walk(self.dst):
-            for name in names:
-                dst.add(name)
+        src = _all_files(self.src)
+        dst = _all_files(self.dst)
         self.assertEqual(src, dst)
         self.assertEqual(self.todo.qsize(), 0)
-        self.assertEqual(self.done.qsize(), 3)
+        msgs = drain(self.done)
+        self.assertEqual(len(msgs), 3)
+        self.assertTrue(all(msg.status == 0 for msg in msgs))
+
+    def testRunBatch(self):
+        """Test if Porter transfers files sharing a location in batches.
+        """
+        config = self._config("cp {batch} {dest}")
+        cmd = Porter(config, self.todo, self.done, chunk_size=3)
+        cmd.run()
+
+        src = _all_files(self.src)
+        dst = _all_files(self.dst)
+        self.assertEqual(src, dst)
+        msgs = drain(self.done)
+        self.assertEqual(sorted(len(msg.files) for msg in msgs), [1, 2])
+        self.assertTrue(all(msg.status == 0 for msg in msgs))
+
+    def testRunStdin(self):
+        """Test if Porter passes names of files in a batch on stdin.
+        """
+        config = self._config('sh -c "cd {srcdir} && xargs cp -t {dest}"')
+        cmd = Porter(config, self.todo, self.done, chunk_size=3)
+        cmd.run()
+
+        src = _all_files(self.src)
+        dst = _all_files(self.dst)
+        self.assertEqual(src, dst)
+        msgs = drain(self.done)
+        self.assertEqual(sorted(len(msg.files) for msg in msgs), [1, 2])
+        self.assertTrue(all(msg.status == 0 for msg in msgs))
+
+    def testRunWorkers(self):
+        """Test if workers transfer files concurrently.
+        """
+        config = self._config('sh -c "sleep 1 && cp $0 $1" {file} {dest}')
+        cmd = Porter(config, self.todo, self.done, num_workers=3,
+                     parallelism=1)
+        start = time.monotonic()
+        cmd.run()
+        self.assertLess(time.monotonic() - start, 2.5)
+
+        src = _all_files(self.src)
+        dst = _all_files(self.dst)
+        self.assertEqual(src, dst)
+        msgs = drain(self.done)
+        self.assertEqual(len(msgs), 3)
+        self.assertTrue(all(msg.status == 0 for msg in msgs))
+
+    def testRunFailure(self):
+        """Test if Porter reports failed transfers and reduces chunk size.
+        """
+        config = self._config("false {file} {dest}")
+        cmd = Porter(config, self.todo, self.done, chunk_size=4)
+        cmd.run()
+
+        self.assertEqual(_all_files(self.dst), set())
+        msgs = drain(self.done)
+        self.assertEqual(len(msgs), 3)
+        self.assertTrue(all(msg.status == errno.EREMOTEIO for msg in msgs))
+        self.assertTrue(all(msg.rate is None for msg in msgs))
+        self.assertEqual(cmd._current_chunk, 2)
+
+    def testRunTimeout(self):
+        """Test if Porter terminates transfers taking too long.
+        """
+        config = self._config('sh -c "sleep 10" {batch} {dest}')
+        cmd = Porter(config, self.todo, self.done, chunk_size=3, timeout=1,
+                     parallelism=2)
+        start = time.monotonic()
+        cmd.run()
+        self.assertLess(time.monotonic() - start, 5)
+
+        self.assertEqual(_all_files(self.dst), set())
+        msgs = drain(self.done)
+        self.assertEqual(len(msgs), 2)
+        self.assertTrue(all(msg.status == errno.ETIME for msg in msgs))
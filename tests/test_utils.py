@@ -0,0 +1,132 @@
+# This file is part of dbb_buffer_mngr.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures.process
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from lsst.dbb.buffmngrs.handoff import utils
+from lsst.dbb.buffmngrs.handoff.utils import (CHECKSUM_POOL_MIN_FILES,
+                                              checksum_many, get_checksum)
+
+
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _write(dirname, name, data):
+    """Create a file with a given content.
+    """
+    path = os.path.join(dirname, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class ChecksumTestCase(unittest.TestCase):
+    """Test functions calculating checksums of files.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base = tempfile.mkdtemp(dir=_TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.base)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=self.base)
+        self.data = os.urandom(4096)
+        self.path = _write(self.root, "a", self.data)
+
+    def testMethods(self):
+        """Test if supported hash functions are used.
+        """
+        methods = {"blake2": hashlib.blake2b, "md5": hashlib.md5,
+                   "sha1": hashlib.sha1, "sha256": hashlib.sha256,
+                   "unknown": hashlib.blake2b}
+        for method, constructor in methods.items():
+            expected = constructor(self.data).hexdigest()
+            with self.subTest(method=method):
+                result = get_checksum(self.path, method=method)
+                self.assertEqual(result, expected)
+
+    @unittest.skipIf(utils.blake3 is None, "blake3 is not installed")
+    def testBlake3(self):
+        """Test if BLAKE3 is used if available.
+        """
+        expected = utils.blake3.blake3(self.data).hexdigest()
+        self.assertEqual(get_checksum(self.path, method="blake3"), expected)
+
+    def testBlocks(self):
+        """Test if a file is hashed block by block without file_digest().
+        """
+        expected = hashlib.blake2b(self.data).hexdigest()
+        with unittest.mock.patch.object(utils, "_file_digest", None):
+            result = get_checksum(self.path, block_size=1000)
+        self.assertEqual(result, expected)
+
+    def testChecksumMany(self):
+        """Test if checksums of multiple files are calculated.
+        """
+        paths = [_write(self.root, f"f{i}", os.urandom(i))
+                 for i in range(CHECKSUM_POOL_MIN_FILES)]
+        expected = {path: get_checksum(path) for path in paths}
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                result = checksum_many(paths, workers=workers)
+                self.assertEqual(result, expected)
+
+    def testBrokenPool(self):
+        """Test if checksums are calculated even if worker processes die.
+        """
+        paths = [_write(self.root, f"f{i}", os.urandom(i))
+                 for i in range(CHECKSUM_POOL_MIN_FILES)]
+        expected = {path: get_checksum(path) for path in paths}
+        err = concurrent.futures.process.BrokenProcessPool("killed")
+        with unittest.mock.patch("concurrent.futures.ProcessPoolExecutor",
+                                 side_effect=err):
+            result = checksum_many(paths, workers=2)
+        self.assertEqual(result, expected)
+
+    def testEmptyFile(self):
+        """Test if an empty file is hashed.
+        """
+        os.truncate(self.path, 0)
+        expected = hashlib.blake2b().hexdigest()
+        self.assertEqual(get_checksum(self.path), expected)
+
+    def testMissingFile(self):
+        """Test if a missing file does not abort the whole batch.
+        """
+        missing = os.path.join(self.root, "b")
+        result = checksum_many([self.path, missing], workers=1)
+        expected = hashlib.blake2b(self.data).hexdigest()
+        self.assertEqual(result, {self.path: expected, missing: None})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+# This file is part of dbb_buffer_mngr.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+import jsonschema
+from lsst.dbb.buffmngrs.handoff import validation
+from lsst.dbb.buffmngrs.handoff.validation import validate, validate_file
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+_VALID = """
+handoff:
+  buffer: /data/buffer
+  holding: /data/holding
+endpoint:
+  user: jdoe
+  host: example.edu
+  buffer: /data/buffer
+"""
+
+_INVALID = """
+handoff:
+  buffer: /data/buffer
+"""
+
+
+class ValidateTestCase(unittest.TestCase):
+    """Test validating configurations against the schema.
+    """
+
+    def testValid(self):
+        """Test if a valid configuration is accepted.
+        """
+        config = dict(handoff=dict(buffer="/b", holding="/h"),
+                      endpoint=dict(user="u", host="h", buffer="/b"))
+        validate(config)
+
+    def testSchema(self):
+        """Test if the schema can be used by other libraries.
+        """
+        json.dumps(validation.SCHEMA)
+        config = dict(handoff=dict(buffer="/b", holding="/h"),
+                      endpoint=dict(user="u", host="h", buffer="/b"))
+        jsonschema.validate(config, validation.SCHEMA)
+
+    def testInvalid(self):
+        """Test if an invalid configuration is rejected.
+        """
+        config = dict(handoff=dict(buffer="/b"))
+        self.assertRaises(ValueError, validate, config)
+
+        config = dict(handoff=dict(buffer="/b", holding="/h"),
+                      endpoint=dict(user="u", host="h", buffer="/b"),
+                      general=dict(chunk_size=0))
+        self.assertRaises(ValueError, validate, config)
+
+
+class ValidatorTestCase(unittest.TestCase):
+    """Test building the function validating configurations.
+    """
+
+    def setUp(self):
+        validation._get_validator.cache_clear()
+        self.addCleanup(validation._get_validator.cache_clear)
+
+    def testJsonschema(self):
+        """Test if jsonschema is used if fastjsonschema is not available.
+        """
+        with unittest.mock.patch.dict(sys.modules, fastjsonschema=None):
+            _, error = validation._get_validator()
+            self.assertIs(error, jsonschema.ValidationError)
+            self.assertRaises(ValueError, validate, {})
+
+    @unittest.skipIf(fastjsonschema is None, "fastjsonschema not installed")
+    def testFastjsonschema(self):
+        """Test if fastjsonschema is used if available.
+        """
+        _, error = validation._get_validator()
+        self.assertIs(error, fastjsonschema.JsonSchemaException)
+        self.assertRaises(ValueError, validate, {})
+
+    def testInvalidSchema(self):
+        """Test if an invalid schema is reported as ValueError.
+        """
+        schema = {"type": "nonsense"}
+        with unittest.mock.patch.object(validation, "_SCHEMA", schema):
+            with unittest.mock.patch.dict(sys.modules, fastjsonschema=None):
+                self.assertRaises(ValueError, validate, {})
+            if fastjsonschema is not None:
+                validation._get_validator.cache_clear()
+                self.assertRaises(ValueError, validate, {})
+
+
+class ValidateFileTestCase(unittest.TestCase):
+    """Test validating configuration files with cached results.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base = tempfile.mkdtemp(dir=_TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.base)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=self.base)
+        self.cache = os.path.join(self.root, "cache", "dbb_handoff",
+                                  "validation.cache")
+        patcher = unittest.mock.patch.object(validation, "CACHE_FILE",
+                                             self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = self._write("config.yaml", _VALID)
+
+    def _write(self, name, content):
+        """Create a configuration file.
+        """
+        path = os.path.join(self.root, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def _validate(self, path):
+        """Validate a file, return True if it was actually validated.
+        """
+        with unittest.mock.patch.object(validation, "validate",
+                                        wraps=validation.validate) as mock:
+            validate_file(path)
+        return mock.called
+
+    def testCacheHit(self):
+        """Test if a file is validated only once.
+        """
+        self.assertTrue(self._validate(self.path))
+        self.assertFalse(self._validate(self.path))
+        with open(self.cache) as f:
+            self.assertIn(self.path, json.load(f))
+
+    def testModifiedFile(self):
+        """Test if a file is validated again after it was modified.
+        """
+        self.assertTrue(self._validate(self.path))
+        with open(self.path, "a") as f:
+            f.write("  staging: /data/staging\n")
+        self.assertTrue(self._validate(self.path))
+
+        status = os.stat(self.path)
+        os.utime(self.path, ns=(status.st_atime_ns, status.st_mtime_ns + 1))
+        self.assertTrue(self._validate(self.path))
+
+    def testModifiedSchema(self):
+        """Test if a file is validated again after the schema changed.
+        """
+        self.assertTrue(self._validate(self.path))
+        with unittest.mock.patch.object(validation, "SCHEMA_HASH", "other"):
+            self.assertTrue(self._validate(self.path))
+
+    def testCorruptCache(self):
+        """Test if a corrupt cache is ignored and replaced.
+        """
+        os.makedirs(os.path.dirname(self.cache))
+        with open(self.cache, "w") as f:
+            f.write("{not json")
+        self.assertTrue(self._validate(self.path))
+        self.assertFalse(self._validate(self.path))
+
+    def testUnwritableCache(self):
+        """Test if a cache which can't be written does not cause errors.
+        """
+        # The cache can't be created where its directory should be.
+        with open(os.path.join(self.root, "cache"), "w"):
+            pass
+        self.assertTrue(self._validate(self.path))
+        self.assertTrue(self._validate(self.path))
+
+    def testInvalidFile(self):
+        """Test if an invalid file is rejected and never cached.
+        """
+        path = self._write("invalid.yaml", _INVALID)
+        self.assertRaises(ValueError, validate_file, path)
+        self.assertRaises(ValueError, validate_file, path)
+
+        validate_file(self.path)
+        with open(self.cache) as f:
+            self.assertNotIn(path, json.load(f))
+
+
+if __name__ == "__main__":
+    unittest.main()
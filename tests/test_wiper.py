@@ -27,17 +27,34 @@ import unittest
 from lsst.dbb.buffmngrs.handoff import Wiper
 
 
+# Fixtures are only created, scanned and removed, so they are kept in memory
+# if possible.
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+_USER = getpass.getuser()
+_HOST = "localhost"
+
+# Commands meant for the endpoint site are executed locally, so the tests do
+# not need a running SSH server.
+_COMMANDS = {"remote": 'sh -c "{command}"'}
+
+
 class WiperTestCase(unittest.TestCase):
     """Test the command cleaning up the staging area on the endpoint site.
     """
 
-    def setUp(self):
-        self.dir = tempfile.mkdtemp()
-        self.user = getpass.getuser()
-        self.host = "localhost"
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(dir=_TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
 
-    def tearDown(self):
-        shutil.rmtree(self.dir)
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(dir=self.root)
+        self.user = _USER
+        self.host = _HOST
 
     def testInvalidConfig(self):
         """Test if Wiper complains about an invalid configuration.
@@ -46,36 +63,31 @@ class WiperTestCase(unittest.TestCase):
         args = [config]
         self.assertRaises(ValueError, Wiper, *args)
 
-    @unittest.skip("needs a running sshd")
     def testEmpty(self):
         """Test if Wiper removes empty directory.
         """
-        tempfile.mkdtemp(dir=self.dir)
+        os.mkdir(os.path.join(self.dir, "sub"), 0o700)
 
-        config = dict(user=self.user, host=self.host, staging=self.dir)
+        config = dict(user=self.user, host=self.host, staging=self.dir,
+                      commands=_COMMANDS)
         cmd = Wiper(config)
         cmd.run()
 
-        dirs = []
-        for top, subs, files in os.walk(self.dir):
-            for d in subs:
-                dirs.append(d)
-        self.assertEqual(len(dirs), 0)
+        with os.scandir(self.dir) as it:
+            self.assertIsNone(next((e for e in it if e.is_dir()), None))
 
-    @unittest.skip("needs a running sshd")
     def testNonEmpty(self):
         """Test if Wiper does not remove non-empty directory.
         """
-        subdir = tempfile.mkdtemp(dir=self.dir)
-        fd, fn = tempfile.mkstemp(dir=os.path.join(self.dir, subdir))
+        subdir = os.path.join(self.dir, "sub")
+        os.mkdir(subdir, 0o700)
+        fd, fn = tempfile.mkstemp(dir=subdir)
         os.close(fd)
 
-        config = dict(user=self.user, host=self.host, staging=self.dir)
+        config = dict(user=self.user, host=self.host, staging=self.dir,
+                      commands=_COMMANDS)
         cmd = Wiper(config)
         cmd.run()
 
-        dirs = []
-        for top, subs, files in os.walk(self.dir):
-            for d in subs:
-                dirs.append(d)
-        self.assertEqual(len(dirs), 1)
+        with os.scandir(self.dir) as it:
+            self.assertEqual(sum(1 for e in it if e.is_dir()), 1)